@@ -11,6 +11,6 @@ fi
 
 export LD_LIBRARY_PATH=/share/CACHEDEV1_DATA/.qpkg/QPython3/lib
 
-find "$1" -type f -name 'DSCF*.MOV' -exec fuji.py auto-convert {} \;
+find "$1" -type f -name 'DSCF*.MOV' -exec "$SRCDIR/ffmpeg.py" auto-convert {} \;
 
 #$SRCDIR/fix-video-time.sh
@@ -1,15 +1,33 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+import functools
+import glob
 import json
 import multiprocessing
+import os
 from os import path
+import re
+import shlex
+import shutil
+import subprocess
 import sys
 
 import argh
-import sh
+
+# orjson is optional, it parses ffprobe output faster than json.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 SRC_DIR = path.abspath(path.dirname(__file__))
 
+PROBE_CACHE_FILE = path.join(
+    os.environ.get('XDG_CACHE_HOME', path.expanduser('~/.cache')),
+    'camutil', 'probe.json')
+
 VIDEO_OPTIONS = {
     # FFmpeg docs says CRF "subjectively sane range is 17-28", thus we use 17.
     # https://trac.ffmpeg.org/wiki/Encode/H.264#a1.ChooseaCRFvalue
@@ -30,33 +48,158 @@ VIDEO_OPTIONS = {
         'crf': 22,
         'preset': 'medium'
     },
+    # Hardware encoders don't support crf, use their constant quality mode
+    # instead. Quality values are chosen to give bit rate close to libx265
+    # with crf 22.
+    # Apple Silicon only, Intel Mac's VideoToolbox doesn't support -q:v.
+    'hevc_videotoolbox': {
+        'q:v': 65,
+    },
+    'h264_videotoolbox': {
+        'q:v': 65,
+    },
+    'hevc_nvenc': {
+        'preset': 'p4',
+        'rc': 'vbr',
+        'cq': 24,
+        'b:v': 0,
+    },
+    'hevc_qsv': {
+        'preset': 'slow',
+        'global_quality': 24,
+    },
 }
 
-FRAMERATE_MAPPING = {
-    '24/1': 24,
-    '24000/1001': 24,
-    '25/1': 25,
-    '30/1': 30,
-    '30000/1001': 30,
-    '60000/1001': 60,
+HW_ENCODERS = ('hevc_videotoolbox', 'h264_videotoolbox', 'hevc_nvenc', 'hevc_qsv')
+
+# Codec produced by each video encoder, as reported by ffprobe codec_name.
+ENCODER_CODEC = {
+    'libx264': 'h264',
+    'libx265': 'hevc',
+    'hevc_videotoolbox': 'hevc',
+    'h264_videotoolbox': 'h264',
+    'hevc_nvenc': 'hevc',
+    'hevc_qsv': 'hevc',
 }
 
+# Copy video stream instead of re-encoding when input is already encoded with
+# the target codec and its bit rate is below this value.
+COPY_MAX_BIT_RATE = 50_000_000
+
+# Output options which don't depend on input file or encoder.
+MOV_OUTPUT_OPTIONS = (
+    # Copy metadata so we can reserve video creation time etc.
+    '-map_metadata', '0',
+    # Write custom tags. According to https://superuser.com/a/1208277/87009
+    '-movflags', 'use_metadata_tags',
+    # Color related options.
+    # For writing color atom. (Show things like HD (1-1-1) in QuickTime Player inspector.)
+    '-movflags', '+write_colr', '-strict', 'experimental',
+    # Let audio packets queue up while the slow video encoder catches up
+    # instead of stalling the muxer.
+    '-max_muxing_queue_size', '1024',
+)
+
+# Stream metadata returned by probe.
+_PROBE_COMMON_KEYS = ('codec_name', 'bit_rate', 'duration')
+# Not sure how to specify chroma location in encoding.
+# But X-T3 HEVC output video have chroma_location unspecified, maybe this
+# is not important.
+PROBE_VIDEO_KEYS = _PROBE_COMMON_KEYS + (
+    'avg_frame_rate', 'r_frame_rate', 'pix_fmt',
+    'color_range', 'color_space', 'color_transfer', 'color_primaries',
+    'chroma_location')
+PROBE_AUDIO_KEYS = _PROBE_COMMON_KEYS + ('sample_rate',)
+# Only let ffprobe output stream entries we use.
+PROBE_SHOW_ENTRIES = 'stream=' + ','.join(
+    dict.fromkeys(('codec_type',) + PROBE_VIDEO_KEYS + PROBE_AUDIO_KEYS))
+
+# Enable x265 pmode and pme when encoding with at least this many threads.
+X265_PARALLEL_ANALYSIS_THREADS = 16
+
+
+@functools.lru_cache(maxsize=None)
+def _which(cmd):
+    """Return full path of cmd, PATH is searched only once for each cmd."""
+    cmd_path = shutil.which(cmd)
+    if cmd_path is None:
+        raise RuntimeError(f'{cmd} not found in PATH')
+    return cmd_path
+
+
+@functools.lru_cache(maxsize=None)
+def hw_encoders():
+    """Return hardware H.264 and HEVC encoders supported by ffmpeg."""
+    out = subprocess.run([_which('ffmpeg'), '-hide_banner', '-encoders'],
+                         capture_output=True, text=True, check=True).stdout
+    return frozenset(re.findall(
+        r'\b(h(?:evc|264)_(?:nvenc|videotoolbox|qsv|vaapi|amf))\b', out))
+
+
+def _load_probe_cache():
+    try:
+        with open(PROBE_CACHE_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_probe_cache(key, metadata):
+    # Reload before writing because concurrent batch_auto_convert jobs may
+    # have added entries since we last read it.
+    cache = _load_probe_cache()
+    cache[key] = metadata
+    os.makedirs(path.dirname(PROBE_CACHE_FILE), exist_ok=True)
+    tmp_fname = f'{PROBE_CACHE_FILE}.{os.getpid()}'
+    with open(tmp_fname, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_fname, PROBE_CACHE_FILE)
+
+
+def probe(input_fname, cache=True):
+    """Use ffprobe to get video file metadata.
 
-def probe(input_fname):
-    """Use ffprobe to get video file metadata."""
+    Result is cached in PROBE_CACHE_FILE, keyed by absolute path, modification
+    time and size of the file. Set cache to False for temporary files.
+    """
+    if not cache:
+        return _ffprobe(input_fname)
+    st = os.stat(input_fname)
+    key = f'{path.abspath(input_fname)}:{st.st_mtime_ns}:{st.st_size}'
+    return _probe_cached(key, input_fname)
+
+
+@functools.lru_cache(maxsize=None)
+def _probe_cached(key, input_fname):
+    cache = _load_probe_cache()
+    if key in cache:
+        return cache[key]
+
+    metadata = _ffprobe(input_fname)
+    _save_probe_cache(key, metadata)
+    return metadata
+
+
+def _ffprobe(input_fname):
+    argv = [_which('ffprobe'), '-hide_banner', '-print_format', 'json',
+            '-show_entries', PROBE_SHOW_ENTRIES, input_fname]
+    # Read stdout and stderr together, reading one to EOF first may deadlock
+    # when ffprobe fills the other pipe.
+    proc = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = proc.stderr.decode()
     try:
-        probe = sh.ffprobe(
-            '-print_format', 'json',
-            '-show_format', '-show_streams',
-            input_fname)
-    except sh.ErrorReturnCode_1 as e:
+        # Parse JSON from the raw bytes instead of keeping a decoded copy of
+        # the whole output.
+        # orjson.JSONDecodeError is a subclass of json.JSONDecodeError.
+        probe_meta = json_loads(proc.stdout)
+    except json.JSONDecodeError:
+        probe_meta = None
+    if proc.returncode != 0 or probe_meta is None:
         print('error running ffprobe:\n'
-              f'RUN:\n{e.full_cmd}\n\n'
-              f'STDOUT:\n{e.stdout}\n\n'
-              f'STDERR:\n{e.stderr}')
+              f'RUN:\n{shlex.join(argv)}\n\n'
+              f'STDERR:\n{stderr}')
         sys.exit(1)
 
-    probe_meta = json.loads(probe.stdout)
     metadata = {}
 
     # Copy video metadata.
@@ -65,26 +208,14 @@ def probe(input_fname):
         print('stream 0 is not video')
         sys.exit(1)
 
-    vmeta = {}
-    common_meta = ['codec_name', 'bit_rate', 'duration']
-    # Not sure how to specify chroma location in encoding.
-    # But X-T3 HEVC output video have chroma_location unspecified, maybe this
-    # is not important.
-    for k in common_meta + ['avg_frame_rate', 'pix_fmt',
-                            'color_range', 'color_space', 'color_transfer', 'color_primaries',
-                            'chroma_location']:
-        vmeta[k] = video_meta.get(k, None)
-    metadata['video'] = vmeta
+    metadata['video'] = {k: video_meta.get(k) for k in PROBE_VIDEO_KEYS}
 
     audio_meta = probe_meta['streams'][1]
     if audio_meta['codec_type'] != 'audio':
         print('stream 1 is not audio')
         sys.exit(1)
 
-    ameta = {}
-    for k in common_meta + ['sample_rate']:
-        ameta[k] = audio_meta[k]
-    metadata['audio'] = ameta
+    metadata['audio'] = {k: audio_meta.get(k) for k in PROBE_AUDIO_KEYS}
 
     return metadata
 
@@ -101,17 +232,25 @@ def convert(input_fname, output_fname,
             duration=None,
             audio_enc='aac', vbr=0, bit_rate='256k',
             video_enc='libx265', color_space='bt709', lut: str = None,
-            threads=None):
+            threads=None, tune=None, copy_max_bit_rate=COPY_MAX_BIT_RATE,
+            cache_probe=True):
     """
     lut: path to LUT file
     audio_enc: audio encoder: libfdk_aac, aac
     vbr: use Variable Bit Rate (VBR) mode to encode audio if not None, valid
         interge range: [1, 5]. Note only libfdk_aac uses this option
     bit_rate: audio encoding bit_rate, only used when vbr is set to 0
-    video_enc: video encoder:  libx265, libx264
+    video_enc: video encoder:  libx265, libx264, or hardware encoders
+        hevc_videotoolbox, h264_videotoolbox, hevc_nvenc, hevc_qsv
     color_space: specify color space, transfer, primaries with the specified
         value. If given 'none', keep color settings the same as input
-    threads: number of threads to use, default is min(4, #cpu_cores)
+    threads: number of encoder threads to use, default is min(4, #cpu_cores)
+    tune: encoder tuning for specific content, e.g. grain, animation. Only for
+        libx264 and libx265
+    copy_max_bit_rate: copy video stream without re-encoding if input video
+        codec is the same as video_enc's and its bit rate (bps) is below this
+        value. Set to 0 to always re-encode
+    cache_probe: cache probe result of input file, disable for temporary files
     """
     if input_fname == output_fname:
         print('error: input and output file name are the same.')
@@ -120,74 +259,100 @@ def convert(input_fname, output_fname,
     if audio_enc not in ('aac', 'libfdk_aac'):
         print(f'invalid audio encoder: {audio_enc}')
         sys.exit(1)
-    if video_enc not in ('libx264', 'libx265'):
+    if video_enc not in VIDEO_OPTIONS:
         print(f'invalid video encoder: {video_enc}')
         sys.exit(1)
+    if video_enc in HW_ENCODERS and video_enc not in hw_encoders():
+        print(f'video encoder not supported by ffmpeg: {video_enc}')
+        sys.exit(1)
+    if tune and video_enc not in ('libx264', 'libx265'):
+        print(f'tune is only supported by libx264 and libx265, not {video_enc}')
+        sys.exit(1)
 
     if threads is None:
         threads = min(4, multiprocessing.cpu_count())
+    threads = int(threads)
 
-    metadata = probe(input_fname)
+    metadata = probe(input_fname, cache=cache_probe)
 
-    ffmpeg = sh.ffmpeg.bake('-y')
+    argv = [_which('ffmpeg'), '-y']
+    if lut:
+        # lut3d interpolates every pixel and is the most expensive filter,
+        # it supports slice threading so give it the same threads budget.
+        argv += ['-filter_threads', str(threads)]
     # Input options.
     if duration:
-        ffmpeg = ffmpeg.bake('-t', duration)
-    ffmpeg = ffmpeg.bake('-i', input_fname)
+        argv += ['-t', str(duration)]
+    argv += ['-i', input_fname]
 
     # Followings are output options.
 
     # Audio options.
     if 'pcm' not in metadata['audio']['codec_name']:
         # For anything that's not pcm, just copy audio stream without encoding.
-        ffmpeg = ffmpeg.bake('-c:a', 'copy')
+        argv += ['-c:a', 'copy']
     else:
-        ffmpeg = ffmpeg.bake('-c:a', audio_enc)
+        argv += ['-c:a', audio_enc]
         if vbr != 0:
-            ffmpeg = ffmpeg.bake('-vbr', vbr)
+            argv += ['-vbr', str(vbr)]
         else:
-            ffmpeg = ffmpeg.bake('-b:a', bit_rate)
+            argv += ['-b:a', bit_rate]
+
+    video_meta = metadata['video']
+
+    if _can_copy_video(video_meta, video_enc, color_space, lut, int(copy_max_bit_rate)):
+        print(f'{input_fname} is already {video_meta["codec_name"]} with bit rate '
+              f'{video_meta["bit_rate"]}, copy video stream without re-encoding')
+        codec = video_meta['codec_name']
+        argv += ['-c:v', 'copy']
+        argv += MOV_OUTPUT_OPTIONS
+        if color_space == 'bt709':
+            # Rewrite color info in bitstream, 1 is bt709 for all three.
+            argv += ['-bsf:v', f'{codec}_metadata=colour_primaries=1:'
+                     'transfer_characteristics=1:matrix_coefficients=1']
+        if codec == 'hevc':
+            argv += ['-tag:v', 'hvc1']
+        _run_ffmpeg(argv + [output_fname])
+        return
 
     # Video options.
     video_options = VIDEO_OPTIONS[video_enc]
 
-    video_meta = metadata['video']
-
-    ffmpeg = ffmpeg.bake(
-        '-c:v', video_enc,
-        '-crf', video_options['crf'],
-        '-preset', video_options['preset'],
-        # Copy metadata so we can reserve video creation time etc.
-        '-map_metadata', 0,
-        # Write custom tags. According to https://superuser.com/a/1208277/87009
-        '-movflags', 'use_metadata_tags',
-        # Color related options.
-        '-pix_fmt', video_meta['pix_fmt'],
-        # For writing color atom. (Show things like HD (1-1-1) in QuickTime Player inspector.)
-        '-movflags', '+write_colr', '-strict', 'experimental')
+    argv += ['-c:v', video_enc]
+    for k, v in video_options.items():
+        argv += [f'-{k}', str(v)]
+    # Hardware encoders support only a few pixel formats, let ffmpeg pick
+    # one instead of keeping the input pixel format. But ffmpeg picks 8-bit
+    # nv12, use p010le to keep 10-bit input (e.g. F-Log) in 10-bit.
+    if video_enc not in HW_ENCODERS:
+        argv += ['-pix_fmt', video_meta['pix_fmt']]
+    elif video_enc.startswith('hevc_') and _is_10bit_pix_fmt(video_meta['pix_fmt']):
+        argv += ['-pix_fmt', 'p010le']
+    argv += MOV_OUTPUT_OPTIONS
+    if tune:
+        argv += ['-tune', tune]
     if video_meta['color_range'] is not None:
-        ffmpeg = ffmpeg.bake('-color_range', video_meta['color_range'])
+        argv += ['-color_range', video_meta['color_range']]
 
     if color_space == 'none':
         # Keep color settings the same as input.
-        ffmpeg = ffmpeg.bake(
+        argv += [
             '-colorspace', video_meta['color_space'],
             '-color_trc', video_meta['color_transfer'],
-            '-color_primaries', video_meta['color_primaries'])
+            '-color_primaries', video_meta['color_primaries']]
     else:
-        ffmpeg = ffmpeg.bake(
+        argv += [
             '-colorspace', color_space,
             '-color_trc', color_space,
-            '-color_primaries', color_space)
+            '-color_primaries', color_space]
 
-    if video_enc == 'libx265':
+    if video_enc == 'libx265' or video_enc.startswith('hevc_'):
         # For QuickTime Player to know it's able to play this file.
-        ffmpeg = ffmpeg.bake('-tag:v', 'hvc1')
+        argv += ['-tag:v', 'hvc1']
     if lut:
-        ffmpeg = ffmpeg.bake(
-            '-vf', 'lut3d={}'.format(lut))
+        argv += ['-vf', 'lut3d={}'.format(lut)]
 
-    frame_rate = FRAMERATE_MAPPING[metadata['video']['avg_frame_rate']]
+    frame_rate = _frame_rate(video_meta)
     # Set keyint is 2x framerate, min-keyint to framerate, as recommended
     # https://en.wikibooks.org/wiki/MeGUI/x264_Settings#keyint
     # This limits gap between keyframes to be less than two seconds.
@@ -199,17 +364,70 @@ def convert(input_fname, output_fname,
     if video_enc == 'libx265':
         # Let ffmpeg to specify profile.
         # venc_params += ':profile=main'
-        ffmpeg = ffmpeg.bake('-x265-params', venc_params + f':pools={threads}')
+        x265_params = venc_params + f':pools={threads}'
+        # Parallel mode decision and motion estimation add overhead and only
+        # pay off with many worker threads. Refer to x265 docs for --pmode.
+        # Keep pools sized by threads instead of '+' so concurrent
+        # batch_auto_convert jobs don't oversubscribe CPU cores.
+        if threads >= X265_PARALLEL_ANALYSIS_THREADS:
+            x265_params += ':pmode=1:pme=1'
+        argv += ['-x265-params', x265_params]
     elif video_enc == 'libx264':
-        ffmpeg = ffmpeg.bake('-x264-params', venc_params)
+        argv += ['-x264-params', venc_params + f':threads={threads}']
+    else:
+        argv += ['-g', str(frame_rate * 2), '-keyint_min', str(frame_rate)]
+
+    # Encoder threads are set by x265 pools and x264 threads param, let
+    # ffmpeg decide threads for everything else.
+    argv += ['-threads', '0', output_fname]
+    _run_ffmpeg(argv)
+
+
+def _is_10bit_pix_fmt(pix_fmt):
+    # e.g. yuv420p10le, yuv422p10le, p010le
+    return pix_fmt is not None and ('p10' in pix_fmt or pix_fmt.startswith('p010'))
+
+
+def _frame_rate(video_meta):
+    """Return frame rate rounded to integer fps."""
+    # Frame rate is a fraction like '30000/1001'. ffprobe reports '0/0' if
+    # it can't compute avg_frame_rate, use r_frame_rate then.
+    for key in ('avg_frame_rate', 'r_frame_rate'):
+        rate = video_meta.get(key)
+        if rate and not rate.endswith('/0'):
+            return round(Fraction(rate))
+    print(f'unknown video frame rate: {video_meta.get("avg_frame_rate")}')
+    sys.exit(1)
+
 
-    print(f'{ffmpeg} {output_fname}')
-    ffmpeg('-threads', threads, output_fname, _out=sys.stdout, _err=sys.stderr)
+def _can_copy_video(video_meta, video_enc, color_space, lut, copy_max_bit_rate):
+    """Whether input video stream can be copied instead of re-encoded."""
+    if lut or color_space not in ('bt709', 'none'):
+        return False
+    if video_meta['codec_name'] != ENCODER_CODEC[video_enc]:
+        return False
+    # Some containers don't record stream bit rate.
+    if video_meta['bit_rate'] is None:
+        return False
+    return int(video_meta['bit_rate']) < copy_max_bit_rate
 
 
-def auto_convert(input_fname):
+def _run_ffmpeg(argv):
+    # Print a command which can be copied and run in shell.
+    print(shlex.join(argv))
+    subprocess.run(argv, stdout=sys.stdout, stderr=sys.stderr, check=True)
+
+
+def run_ffmpeg(args):
+    """Run ffmpeg with args, printing the command first."""
+    _run_ffmpeg([_which('ffmpeg'), *args])
+
+
+def auto_convert(input_fname, threads=None):
     """
     Automatically guess options and what to do with input file.
+
+    threads: passed to convert
     """
     if 'original' in input_fname:
         print(f'skip converting {input_fname}')
@@ -219,7 +437,7 @@ def auto_convert(input_fname):
     if outdir == '':
         outdir = '.'
     converting_dir = path.join(outdir, 'converting')
-    sh.mkdir('-p', converting_dir)
+    os.makedirs(converting_dir, exist_ok=True)
     out_basename = path.splitext(path.basename(input_fname))[0] + '.mov'
     out_fname = path.join(converting_dir, out_basename)
 
@@ -229,18 +447,41 @@ def auto_convert(input_fname):
     else:
         print(f'convert {input_fname} without lut')
         lut = None
-    convert(input_fname, out_fname, lut=lut)
+    convert(input_fname, out_fname, lut=lut, threads=threads)
 
     original_dir = path.join(path.dirname(input_fname), 'original')
-    sh.mkdir('-p', original_dir)
-    sh.mv(input_fname, original_dir)
+    os.makedirs(original_dir, exist_ok=True)
+    # Directories are on the same file system, rename is enough.
+    os.replace(input_fname, path.join(original_dir, path.basename(input_fname)))
+
+    os.replace(out_fname, path.join(outdir, out_basename))
+
+
+def batch_auto_convert(pattern, jobs: int = 2):
+    """
+    Run auto_convert on all files matching glob pattern, jobs files at a time.
+
+    pattern: glob pattern for input files, quote it to avoid shell expansion
+    jobs: number of files to convert concurrently. CPU cores are divided
+        evenly among jobs
+    """
+    fnames = sorted(glob.glob(pattern))
+    if len(fnames) == 0:
+        print(f'no files match {pattern}')
+        return
 
-    sh.mv('-f', out_fname, outdir)
+    threads = max(1, multiprocessing.cpu_count() // jobs)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(auto_convert, f, threads=threads)
+                   for f in fnames]
+        for f in futures:
+            f.result()
 
 
 if __name__ == "__main__":
     argh.dispatch_commands([
         convert,
         auto_convert,
+        batch_auto_convert,
         probe,
     ])
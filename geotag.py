@@ -1,21 +1,28 @@
 #!/usr/bin/env python3
 
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 import datetime
-import glob
-import io
+import fnmatch
 import os
 from os import path
 from pathlib import Path
+import queue
 import re
+import shutil
+import subprocess
 import sys
-from typing import Dict, List, Optional, Union
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar, Union
 
 import argh
-import sh
 
 
 SRC_DIR = Path(__file__).parent.absolute()
 
+T = TypeVar('T')
+
 EXIF_DATE_TAGS = ['CreateDate', 'DateTimeOriginal', 'ModifyDate', 'DateCreated']
 #EXIF_DATE_TAGS = ['CreateDate', 'DateTimeOriginal', 'ModifyDate', 'DateCreated', 'IPTC:TimeCreated', 'IPTC:DigitalCreationTime']
 EXIF_VIDEO_DATE_TAGS = EXIF_DATE_TAGS + [
@@ -43,18 +50,21 @@ DEFAULT_CAMERA_MODEL = {
 }
 
 
-# It's possible that I rename file to add information about the video.
-_FNAME_RE_SONY_VIDEO = re.compile(r'C\d\d\d\d.*\.MP4')
-_FNAME_RE_SONY_IMAGE = re.compile(r'DSC\d\d\d\d.*')
+def _is_sony_file(name: str):
+    # It's possible that I rename file to add information about the video,
+    # so only check file name prefix and suffix.
+    # Video: C0001*.MP4, image: DSC00001*.
+    if name.startswith('C') and name[1:5].isdigit() and name.endswith('.MP4'):
+        return True
+    return name.startswith('DSC') and name[3:7].isdigit()
 
 
 def guess_camera_maker(fname: str):
-    if _FNAME_RE_SONY_IMAGE.match(fname) or _FNAME_RE_SONY_VIDEO.match(fname):
-        print('guessed SONY camera file')
+    name = path.basename(fname)
+    if _is_sony_file(name):
         return 'SONY'
 
-    if Path(fname).name.startswith('DSCF'):
-        print('guessed Fujifilm camera file')
+    if name.startswith('DSCF'):
         return 'Fujifilm'
 
     return None
@@ -124,7 +134,8 @@ def _exiftool_tag_option(tag_values : Dict[str, str], exclude_keys=[]):
 
 def _filter_no_tag_file(fpath: List[str], tags: List[str]):
     """Keep only files that have no GPS tags."""
-    notag_fpath = [f for f in fpath if len(read_exif_tag(f, tags)) == 0]
+    tag_values = read_exif_tags(fpath, tags)
+    notag_fpath = [f for f in fpath if len(tag_values[f]) == 0]
     if len(notag_fpath) != len(fpath):
         skip = set(fpath) - set(notag_fpath)
         print(f'skip files: {", ".join(skip)}')
@@ -135,11 +146,19 @@ def glob_extend(fpath: List[str], pattern: str):
     if pattern is None:
         return fpath
 
+    # Compile pattern once instead of matching through fnmatch for each file.
+    match = re.compile(fnmatch.translate(pattern)).match
     lst = []
     for f in fpath:
         if path.isdir(f):
-            matches = glob.glob(path.join(f, pattern))
-            matches.sort()
+            # scandir returns file type from directory entries, no need to stat
+            # each file. Skip hidden files like glob does, this also skips
+            # macOS's AppleDouble "._*" files.
+            with os.scandir(f) as it:
+                matches = sorted(
+                    e.path for e in it
+                    if match(e.name) and not e.name.startswith('.')
+                    and e.is_file())
             lst.extend(matches)
         else:
             lst.append(f)
@@ -151,19 +170,254 @@ def is_video(fname: str):
     return fname.endswith("mov") or fname.endswith("mp4")
 
 
-exiftool = sh.exiftool.bake("-api", "largefilesupport=1", _out=sys.stdout, _err=sys.stderr)
+# Common arguments for all exiftool commands.
+EXIFTOOL_COMMON_ARGS = ["-api", "largefilesupport=1"]
+EXIFTOOL = ["exiftool", *EXIFTOOL_COMMON_ARGS]
+
+
+def _run(argv: List[str]):
+    """Run a one-off command, its output goes to our stdout and stderr.
+
+    Use this instead of the exiftool daemon for a single large command.
+    """
+    subprocess.run(argv, stdout=sys.stdout, stderr=sys.stderr, check=True)
+
+
+def _run_exiftool_on_files(argv: List[str], files: List[str]):
+    """Run exiftool command on files, passing file names in an argfile.
+
+    Passing hundreds of file names on command line may exceed its length
+    limit. exiftool reads one argument per line from the file given by `-@`.
+    """
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.args', delete=False) as f:
+        f.writelines(f'{fname}\n' for fname in files)
+    try:
+        _run(argv + ['-@', f.name])
+    finally:
+        os.unlink(f.name)
+
+
+class ExifToolDaemon:
+    """A long running exiftool process started with `-stay_open True`.
+
+    Starting exiftool loads the Perl interpreter and all ExifTool modules,
+    which dominates run time for commands processing only a few files. The
+    daemon reads arguments from stdin and runs a command on each `-execute`,
+    so this startup cost is paid only once.
+    """
+
+    def __init__(self, *common_args: str):
+        argv = ["exiftool", "-stay_open", "True", "-@", "-"]
+        if common_args:
+            argv += ["-common_args", *common_args]
+        self.proc = subprocess.Popen(
+            argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.seq = 0
+        # Drain stderr in another thread while we read stdout. Otherwise
+        # exiftool blocks on a full stderr pipe when a command prints lots of
+        # warnings, while we wait for its stdout.
+        self._stderr_lines = queue.Queue()
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
+
+    def execute(self, *args: str) -> str:
+        """Run exiftool command with args and return its output.
+
+        Warnings and errors are printed to stderr. Raise RuntimeError if
+        exiftool reports an error.
+        """
+        cmd, ready = self._command(args)
+        self.proc.stdin.write(cmd)
+        self.proc.stdin.flush()
+        out, err = self._read_output(ready)
+        self._check_error([err])
+        return out
+
+    def execute_batch(self, commands: List[List[str]]) -> List[str]:
+        """Run multiple exiftool commands and return output of each command.
+
+        All commands are sent before reading any output, so exiftool runs them
+        back to back without waiting for us between commands.
+        """
+        cmds, readys = zip(*[self._command(args) for args in commands])
+        # Write from another thread. Otherwise we may block on a full stdin pipe
+        # while exiftool blocks on a full stdout pipe.
+        writer = threading.Thread(target=self._write, args=(b"".join(cmds),))
+        writer.start()
+        outputs = [self._read_output(ready) for ready in readys]
+        writer.join()
+        self._check_error([err for _, err in outputs])
+        return [out for out, _ in outputs]
+
+    def _command(self, args) -> Tuple[bytes, str]:
+        self.seq += 1
+        # "-execute{seq}" makes exiftool print "{ready{seq}}" to stdout when
+        # the command finishes, "-echo4" prints the same marker to stderr
+        # after processing, so we know where output of this command ends on
+        # both pipes.
+        ready = f"{{ready{self.seq}}}"
+        cmd = "".join(f"{a}\n" for a in args) + f"-echo4\n{ready}\n-execute{self.seq}\n"
+        return cmd.encode("utf-8"), ready
+
+    def _write(self, data: bytes):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def _drain_stderr(self):
+        for l in iter(self.proc.stderr.readline, b""):
+            self._stderr_lines.put(l)
+        self._stderr_lines.put(b"")
+
+    def _read_output(self, ready: str) -> Tuple[str, str]:
+        out = self._read_until(self.proc.stdout.readline, ready)
+        err = self._read_until(self._stderr_lines.get, ready)
+        if err:
+            with _print_lock:
+                print(err, end="", file=sys.stderr)
+        return out, err
+
+    @staticmethod
+    def _check_error(errs: List[str]):
+        for err in errs:
+            if any(l.startswith("Error") for l in err.splitlines()):
+                raise RuntimeError(f"exiftool error: {err}")
+
+    @staticmethod
+    def _read_until(readline: Callable[[], bytes], ready: str) -> str:
+        marker = f"{ready}\n".encode("utf-8")
+        lines = []
+        while True:
+            l = readline()
+            if l == b"":
+                raise RuntimeError("exiftool daemon exited unexpectedly")
+            if l == marker:
+                break
+            lines.append(l)
+        return b"".join(lines).decode("utf-8")
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.stdin.write(b"-stay_open\nFalse\n")
+            self.proc.stdin.flush()
+            self.proc.wait()
+
+
+# Avoid interleaving output when running exiftool in multiple threads.
+_print_lock = threading.Lock()
+
+_thread_local = threading.local()
+
+
+def exiftool_daemon() -> ExifToolDaemon:
+    """Return exiftool daemon of current thread, start it on first call.
+
+    Each thread has its own daemon, so threads can run exiftool in parallel.
+    """
+    daemon = getattr(_thread_local, "daemon", None)
+    if daemon is None:
+        daemon = ExifToolDaemon(*EXIFTOOL_COMMON_ARGS)
+        atexit.register(daemon.close)
+        _thread_local.daemon = daemon
+    return daemon
+
+
+def _exiftool(*args: str):
+    """Run exiftool command through the daemon and print its output."""
+    out = exiftool_daemon().execute(*args)
+    with _print_lock:
+        print(out, end="")
+
+
+_exiftool_executor = None
+
+
+def _exiftool_parallel(fn: Callable[[List], T], items: List) -> List[T]:
+    """Split items into chunks and call fn on each chunk in parallel.
+
+    fn should run exiftool through exiftool_daemon(). Worker threads are kept
+    for reuse, so their exiftool daemons are started only once.
+    """
+    # When called from fn running in a worker thread, waiting for other
+    # workers may deadlock if all workers are busy. Run in current thread
+    # instead.
+    if getattr(_thread_local, "in_exiftool_worker", False):
+        return [fn(items)]
+
+    global _exiftool_executor
+    if _exiftool_executor is None:
+        _exiftool_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+    def run(chunk: List) -> T:
+        _thread_local.in_exiftool_worker = True
+        return fn(chunk)
+
+    nchunk = min(os.cpu_count(), len(items))
+    chunks = [items[i::nchunk] for i in range(nchunk)]
+    return list(_exiftool_executor.map(run, chunks))
+
+
+# Tags read by read_exif_tag, keyed by (fname, mtime_ns, tags). Including
+# mtime in key makes cached values invalid after the file is written.
+_exif_tag_cache: Dict[Tuple[str, int, Tuple[str, ...]], Dict[str, str]] = {}
+_exif_tag_cache_lock = threading.Lock()
+
+
+def _fast_read_option(fpath: List[str]) -> List[str]:
+    """Return option to speed up reading tags from fpath.
+
+    -fast avoids scanning image files for trailers. It's not used for video
+    files as QuickTime files may store metadata after the mdat atom, which
+    -fast doesn't read.
+    """
+    if any(is_video(f) for f in fpath):
+        return []
+    return ["-fast"]
 
 
 def read_exif_tag(fname: str, tags: List[str]) -> Dict[str, str]:
     """Read tags and return a dict containing tag & values."""
-    out = io.StringIO()
-    cmd = exiftool.bake("-s2", *[f"-{t}" for t in tags], _out=out)
-    cmd(fname)
+    key = (fname, os.stat(fname).st_mtime_ns, tuple(sorted(tags)))
+    with _exif_tag_cache_lock:
+        r = _exif_tag_cache.get(key)
+    if r is not None:
+        # Return a copy as caller may modify it.
+        return dict(r)
+
+    out = exiftool_daemon().execute(*_fast_read_option([fname]), "-s2", *[f"-{t}" for t in tags], fname)
 
     r = {}
-    for l in out.getvalue().splitlines():
-        k, v = l.split(': ', 1)
+    for l in out.splitlines():
+        k, _, v = l.partition(': ')
         r[k] = v
+    with _exif_tag_cache_lock:
+        _exif_tag_cache[key] = r
+    return dict(r)
+
+
+def read_exif_tags(fpath: List[str], tags: List[str]) -> Dict[str, Dict[str, str]]:
+    """Read tags for multiple files in one exiftool command.
+
+    Return a dict mapping file name to dict containing tag & values.
+    """
+    if len(fpath) <= 1:
+        return {f: read_exif_tag(f, tags) for f in fpath}
+
+    # Arguments go to the daemon through stdin, so long file list will not
+    # exceed command line length limit.
+    out = exiftool_daemon().execute(*_fast_read_option(fpath), "-s2", *[f"-{t}" for t in tags], *fpath)
+
+    # exiftool prints "======== <file>" before tags of each file when
+    # processing multiple files.
+    r = {f: {} for f in fpath}
+    values = None
+    for l in out.splitlines():
+        if l.startswith('======== '):
+            values = r.setdefault(l[len('======== '):], {})
+        elif l.startswith(' '):
+            # Summary lines like "    2 image files read".
+            continue
+        elif values is not None:
+            k, _, v = l.partition(': ')
+            values[k] = v
     return r
 
 
@@ -177,13 +431,12 @@ def shift_time(shift, *fname):
     video_opt = _exiftool_time_shift_option(shift, EXIF_VIDEO_DATE_TAGS)
     pic_opt = _exiftool_time_shift_option(shift, EXIF_DATE_TAGS)
 
-    cmd_pic = exiftool.bake(*pic_opt)
-    cmd_video = exiftool.bake(*video_opt)
-    for f in fname:
-        if is_video(f):
-            cmd_video(f)
-        else:
-            cmd_pic(f)
+    video_fname = [f for f in fname if is_video(f)]
+    pic_fname = [f for f in fname if not is_video(f)]
+    if video_fname:
+        _exiftool(*video_opt, *video_fname)
+    if pic_fname:
+        _exiftool(*pic_opt, *pic_fname)
 
 
 def copy_time(src, *dst):
@@ -199,7 +452,33 @@ def copy_time(src, *dst):
     tag_values = read_exif_tag(src, TIME_TAGS + list(EXIF_CAMERA_MODEL_TAGS.keys()))
     _canonic_camera_model_tag(src, tag_values)
 
-    exiftool(_exiftool_tag_option(tag_values), dst)
+    _exiftool(*_exiftool_tag_option(tag_values), *dst)
+
+
+def copy_time_pairs(pairs: List[Tuple[str, str]]):
+    """Run copy_time for each (src, dst) pair in parallel."""
+    def copy_chunk(chunk: List[Tuple[str, str]]):
+        for src, dst in chunk:
+            copy_time(src, dst)
+
+    # Each worker thread runs copy_time with its own exiftool daemon.
+    _exiftool_parallel(copy_chunk, pairs)
+
+
+def _copy_gps_option(src: str) -> List[str]:
+    """Generate exiftool options to copy GPS tags from src.
+
+    src can contain exiftool format codes such as `%d%f` to copy from a
+    different file for each destination file.
+    """
+    # GPSPosition is a composite tag (combined from other tags) thus not
+    # writable.
+    tags = [t for t in GPS_TAGS if t not in ('GPSPosition', 'GPSCoordinates')]
+    opt = ['-tagsFromFile', src] + [f'-{t}' for t in tags]
+    # iPhone's jpg file has no GPSCoordinates, so we only add that tag for video file.
+    # The later redirection takes priority if GPSCoordinates exists in src.
+    opt += ['-GPSCoordinates<${GPSPosition}, ${GPSAltitude}', '-GPSCoordinates']
+    return opt
 
 
 def copy_gps(src, *dst, time_shift: Optional[Union[int, str]] = 0):
@@ -216,22 +495,11 @@ def copy_gps(src, *dst, time_shift: Optional[Union[int, str]] = 0):
     elif isinstance(time_shift, str):
         time_shift = int(time_shift)
 
-    gps_tag_values = read_exif_tag(src, GPS_TAGS)
-
-    if "GPSCoordinates" not in gps_tag_values and \
-            ("GPSPosition" in gps_tag_values and "GPSAltitude" in gps_tag_values):
-        # iPhone's jpg file has no GPSCoordinates, so we only add that tag for video file.
-        gps_tag_values["GPSCoordinates"] = \
-            f'{gps_tag_values["GPSPosition"]}, {gps_tag_values["GPSAltitude"]}'
-
-    # GPSPosition is a composite tag (combined from other tags) thus not
-    # writable.
-    cmd = exiftool.bake(*_exiftool_tag_option(gps_tag_values, exclude_keys=["GPSPosition"]))
+    opt = _copy_gps_option(src)
     if time_shift != 0:
-        time_shift_option = _exiftool_time_shift_option(time_shift, EXIF_VIDEO_DATE_TAGS)
-        cmd = cmd.bake(*time_shift_option)
+        opt += _exiftool_time_shift_option(time_shift, EXIF_VIDEO_DATE_TAGS)
     print(f"add GPS tag for video file {dst}")
-    cmd(*dst)
+    _exiftool(*opt, *dst)
 
 
 @argh.arg('-f', '--fpath', action='extend', nargs='+', required=True,
@@ -258,14 +526,14 @@ def image(fpath: List[str] = None,
         print(f'no files need to process')
         return
 
-    cmd = exiftool
+    argv = list(EXIFTOOL)
     if overwrite_original:
-        cmd = cmd.bake("-overwrite_original")
+        argv.append("-overwrite_original")
 
     for f in gpslog:
-        cmd = cmd.bake("-geotag", f)
+        argv += ["-geotag", f]
 
-    cmd(*fpath)
+    _run_exiftool_on_files(argv, fpath)
 
 
 @argh.arg('-f', '--fpath', action='extend', nargs='+', required=True,
@@ -279,17 +547,24 @@ def image(fpath: List[str] = None,
                'Defaults to auto which makes guess based on file name')
 @argh.arg('--force',
           help='update GPS tag even if image files already contain GPS tags.')
+@argh.arg('--legacy',
+          help='geotag through temporary jpg files instead of geotagging video files directly')
 def video(fpath: List[str] = None,
           gpslog: List[str] = None,
           pattern: str = None,
           timezone: str = 'auto',
-          force: bool = False):
+          force: bool = False,
+          legacy: bool = False):
     """Geotag for video files using [exiftool](https://exiftool.org/).
 
-    exiftool can geotag all jpeg files under a single directory but not for mov (QuickTime) file.
+    exiftool geotags QuickTime files directly with `-geotag` when given the
+    time to look up in GPS logs with `-Geotime`. We use video create date
+    with the video file's timezone appended as Geotime.
 
-    So for mov files, we copy an empty jpeg file and set its creation time the same as the move file.
-    Let exiftool do geotag then copy the geotag to mov file.
+    Old exiftool can geotag jpeg files but not mov (QuickTime) files. With
+    legacy option, we copy an empty jpeg file and set its creation time the
+    same as the mov file. Let exiftool do geotag then copy the geotag to mov
+    file.
 
     For timezones:
 
@@ -311,44 +586,91 @@ def video(fpath: List[str] = None,
         timezone = int(timezone)
 
     time_shift = _shift_to_utc_timezone(timezone)
+    if legacy:
+        _geotag_video_by_tag_file(fpath, gpslog, timezone, time_shift)
+        return
+
+    argv = list(EXIFTOOL)
+    for f in gpslog:
+        argv += ['-geotag', f]
+    # Video time has no time zone info, append the video file's time zone
+    # to match against GPS log time.
+    argv.append(f'-Geotime<${{CreateDate}}{timezone:+03d}:00')
+    if time_shift != 0:
+        argv += _exiftool_time_shift_option(time_shift, EXIF_VIDEO_DATE_TAGS)
+    print(f"add GPS tag for video file {fpath}")
+    _run_exiftool_on_files(argv, fpath)
+
+
+def video_parallel(fpath: List[str], gpslog: List[str], timezone: str = 'auto'):
+    """Run video on chunks of fpath with multiple exiftool processes in parallel.
+
+    A single exiftool process writes files one by one.
+    """
+    if len(fpath) == 0:
+        return
+    # Guess once so all chunks use the same timezone.
+    if timezone == 'auto':
+        timezone = _guess_video_file_time_zone(fpath[0])
+    _exiftool_parallel(lambda chunk: video(chunk, gpslog=gpslog, timezone=timezone), fpath)
+
+
+def _geotag_video_by_tag_file(fpath: List[str], gpslog: List[str], timezone: int, time_shift: int):
+    """Geotag video files through temporary jpg files."""
     tag_file_time_shift = _shift_to_local_timezone(timezone)
 
     TAG_FILE = SRC_DIR / 'tag.jpg'
 
-    print('====== generate geotag tmp jpg files for each video file ======')
-    video2tag = {}  # For finding jpg tag file later.
-    for vfile in fpath:
-        fname, _ = path.splitext(vfile)
-        dst = f'{fname}_fuji_geotag_tmp.jpg'
-        video2tag[vfile] = dst
-        if path.exists(dst):
-            os.unlink(dst)
-
-        create_date = read_exif_tag(vfile, ['CreateDate'])['CreateDate']
-        date_tag_values = {}
-        for t in EXIF_DATE_TAGS:
-            date_tag_values[t] = create_date
-
-        cmd = exiftool.bake(*_exiftool_tag_option(date_tag_values))
-        # print("    copy create date from video file to jpg geotag file")
-        cmd("-o", dst, str(TAG_FILE), _out=None)
-
-        if tag_file_time_shift != 0:
-            # print(f"    time shift {tag_file_time_shift} for tmp jpg geotag file")
-            cmd = exiftool.bake(
-                "-overwrite_original",
-                *_exiftool_time_shift_option(tag_file_time_shift, EXIF_DATE_TAGS))
-            cmd(dst)
-        print(f'\t{dst} created')
-
-    print('====== geotag for all tmp jpg files ======')
-    image(video2tag.values(), gpslog, overwrite_original=True)
-
-    print('====== copy GPS from tmp jpg to video ======')
-    for vfile in fpath:
-        geotag_jpg_file = video2tag[vfile]
-        copy_gps(geotag_jpg_file, vfile, time_shift=time_shift)
-        os.unlink(geotag_jpg_file)
+    # Video files may be on slow disk or NAS, put tmp jpg files in memory
+    # backed /dev/shm if available. tmp jpg file of each video file is under
+    # the video's absolute directory path inside tmp_dir, so video files with
+    # the same name in different directories won't conflict.
+    tmp_dir = tempfile.mkdtemp(prefix='geotag-', dir='/dev/shm' if path.isdir('/dev/shm') else None)
+    fpath = [path.abspath(f) for f in fpath]
+
+    # Name of tmp jpg file for each video file, as exiftool format codes.
+    TAG_FILE_FMT = f'{tmp_dir}%d%f_fuji_geotag_tmp.jpg'
+
+    # Copy video create date to all date tags of the tmp jpg file, shifted to
+    # local timezone, in a single exiftool command.
+    create_date = '${CreateDate}'
+    if tag_file_time_shift != 0:
+        create_date = f'${{CreateDate;ShiftTime("{tag_file_time_shift}")}}'
+    date_option = [f'-{t}<{create_date}' for t in EXIF_DATE_TAGS]
+
+    gps_option = _copy_gps_option(TAG_FILE_FMT)
+    if time_shift != 0:
+        gps_option += _exiftool_time_shift_option(time_shift, EXIF_VIDEO_DATE_TAGS)
+
+    geotag_option = ['-overwrite_original']
+    for f in gpslog:
+        geotag_option += ['-geotag', f]
+
+    def geotag_chunk(vfiles: List[str]):
+        commands = []
+        tag_files = []
+        for vfile in vfiles:
+            fname, _ = path.splitext(vfile)
+            # exiftool creates directories for output file as needed.
+            dst = f'{tmp_dir}{fname}_fuji_geotag_tmp.jpg'
+            tag_files.append(dst)
+            commands.append(['-tagsFromFile', vfile, *date_option, '-o', dst, str(TAG_FILE)])
+        # Geotag tmp jpg files then copy GPS tags from each tmp jpg file to its
+        # video file.
+        commands.append([*geotag_option, *tag_files])
+        commands.append([*gps_option, *vfiles])
+        outputs = exiftool_daemon().execute_batch(commands)
+        with _print_lock:
+            print(f"add GPS tag for video file {vfiles}")
+            print("".join(outputs), end="")
+
+    try:
+        # Each chunk of video files goes through all steps in its own exiftool
+        # daemon, so one chunk can be geotagging while others are still
+        # creating tmp jpg files.
+        _exiftool_parallel(geotag_chunk, fpath)
+    finally:
+        shutil.rmtree(tmp_dir)
 
 
 @argh.arg('-f', '--fpath', action='extend', nargs='+', required=True,
@@ -370,8 +692,7 @@ def make_model(
         print(f'no files need to process')
         return
 
-    cmd = exiftool.bake(*_exiftool_tag_option({'Make': make, 'Model': model}))
-    cmd(*fpath)
+    _run_exiftool_on_files(EXIFTOOL + _exiftool_tag_option({'Make': make, 'Model': model}), fpath)
 
 
 if __name__ == "__main__":
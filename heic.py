@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
 """
-Convert TIFF files to HEIC with `sips` command on macOS.
+Convert TIFF files to HEIC with `sips` command on macOS, or `heif-enc` from
+libheif on other systems.
 
 CaptureOne does not support export to HEIC files. So I choose to export as TIFF and then
 use this script to convert TIFF to HEIC, along with adding geotags.
@@ -9,33 +10,48 @@ use this script to convert TIFF to HEIC, along with adding geotags.
 Also add geotag to converted HEIC files if gps log file is specified.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from typing import Optional
+import os
 from os import path
+import shutil
+import subprocess
 import sys
 
 import argh
-import sh
 
 import geotag
 
 
-def _convert1(fname: str, quality: int):
+def _convert1(fname: str, quality: int, encoder: str):
     bname, ext = path.splitext(fname)
     if ext == '':
         raise ValueError(f'{fname} has no suffix, is it really an image file?')
 
     out_fname = f'{bname}.heic'
 
-    sh.sips(
-        '-s', 'format', 'heic',
-        '-s', 'formatOptions', f'{quality}',
-        '--out', out_fname,
-        fname,
-        _out=sys.stdout, _err=sys.stderr)
+    if encoder == 'heif-enc':
+        argv = ['heif-enc', '-q', f'{quality}', '-o', out_fname, fname]
+    else:
+        argv = ['sips',
+                '-s', 'format', 'heic',
+                '-s', 'formatOptions', f'{quality}',
+                '--out', out_fname,
+                fname]
+    subprocess.run(argv, stdout=sys.stdout, stderr=sys.stderr, check=True)
     return out_fname
 
 
+def _default_encoder():
+    """Use sips on macOS, otherwise use heif-enc from libheif."""
+    if shutil.which('sips'):
+        return 'sips'
+    if shutil.which('heif-enc'):
+        return 'heif-enc'
+    raise RuntimeError('neither sips nor heif-enc is found in PATH')
+
+
 @argh.arg('-f', '--fpath', action='extend', nargs='+', required=True,
           help='space separated files or directories to add geotag')
 @argh.arg('-g', '--gpslog', action='extend', nargs='+',
@@ -44,14 +60,19 @@ def _convert1(fname: str, quality: int):
           help='when fpath is directory, glob with this file extension')
 @argh.arg('-q', '--quality', type=int, default=89,
           help='when fpath is directory, glob with this file extension')
+@argh.arg('-e', '--encoder', choices=['auto', 'sips', 'heif-enc'],
+          help='HEIC encoder, auto uses sips if available, otherwise heif-enc from libheif')
 def convert_to_heic(fpath: str = None, gpslog: Optional[str] = None,
-                    pattern='*.tif', quality: int = 89):
+                    pattern='*.tif', quality: int = 89, encoder: str = 'auto'):
     """Convert image files to HEIC format."""
     fpath = geotag.glob_extend(fpath, pattern)
+    if encoder == 'auto':
+        encoder = _default_encoder()
 
-    heic_flist = []
-    for fname in fpath:
-        heic_flist.append(_convert1(fname, quality))
+    # sips runs in its own process, so threads are enough to convert files
+    # in parallel.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        heic_flist = list(executor.map(lambda f: _convert1(f, quality, encoder), fpath))
 
     if len(heic_flist) > 0 and gpslog is not None:
         geotag.image(heic_flist, gpslog)
@@ -4,38 +4,151 @@
 Workflow for video files.
 """
 
-import glob
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
+import math
 import os
 from os import path
+import platform
+import queue
+import shutil
+import subprocess
 import sys
-from typing import List
+import tempfile
+from typing import Callable, Dict, List, Optional, Set
 
 import argh
-import sh
 
+import ffmpeg
 import geotag
 
 
 DEFAULT_OUTPUT_DIR = '000hevc'
 DEFAULT_AVCONVERT_PRESET = 'PresetHEVC3840x2160'
 OUTPUT_EXT = 'mov'
+_OUT_SUFFIX = '.' + OUTPUT_EXT
+
+
+# ffmpeg hardware HEVC encoder for each --hwaccel choice.
+HWACCEL_ENCODERS = {
+    'videotoolbox': 'hevc_videotoolbox',
+    'nvenc': 'hevc_nvenc',
+    'qsv': 'hevc_qsv',
+}
+
+
+def _hevc_encoder(hwaccel: str) -> Optional[str]:
+    """Return ffmpeg encoder for hwaccel, None means using avconvert."""
+    if hwaccel == 'none':
+        return None
+    if hwaccel == 'auto':
+        try:
+            supported = ffmpeg.hw_encoders()
+        except (RuntimeError, OSError, subprocess.CalledProcessError):
+            # No usable ffmpeg, e.g. macOS with only avconvert.
+            return None
+        for enc in HWACCEL_ENCODERS.values():
+            # Intel Mac's VideoToolbox doesn't support -q:v used in
+            # ffmpeg.VIDEO_OPTIONS.
+            if enc == 'hevc_videotoolbox' and platform.machine() != 'arm64':
+                continue
+            if enc in supported:
+                return enc
+        return None
+    return HWACCEL_ENCODERS[hwaccel]
 
 
 def convert_one_h265(fname: str, output_fname: str,
-                     preset: str = DEFAULT_AVCONVERT_PRESET):
-    sh.avconvert(
-        verbose=True,
-        preset=preset,
-        source=fname, output=output_fname,
-        _long_sep=' ',
-        _out=sys.stdout, _err=sys.stderr)
+                     preset: str = DEFAULT_AVCONVERT_PRESET,
+                     encoder: Optional[str] = None,
+                     segments: int = 1):
+    if segments > 1:
+        _segment_convert(fname, output_fname, segments, preset, encoder)
+        return
+
+    if encoder is not None:
+        ffmpeg.convert(fname, output_fname, video_enc=encoder)
+        return
+
+    subprocess.run(
+        ['avconvert', '--verbose', '--preset', preset,
+         '--source', fname, '--output', output_fname],
+        stdin=subprocess.DEVNULL, stdout=sys.stdout, stderr=sys.stderr, check=True)
+
+
+def _convert_segment(fname: str, output_fname: str, preset: str, encoder: Optional[str]):
+    if encoder is None:
+        convert_one_h265(fname, output_fname, preset=preset)
+        return
+    # Always re-encode, copying some segments while encoding others would
+    # give segments which can't be joined. Don't cache probe result of
+    # temporary files.
+    ffmpeg.convert(fname, output_fname, video_enc=encoder, copy_max_bit_rate=0,
+                   cache_probe=False)
+
+
+def _segment_convert(fname: str, output_fname: str, segments: int, preset: str,
+                     encoder: Optional[str]):
+    """Split video file into segments, convert them in parallel and join them.
+
+    A single encoder process may not use all CPU cores. Segments are split at
+    key frames, so the number of segments may differ from the requested one.
+    """
+    ext = path.splitext(fname)[1]
+    duration = ffmpeg.probe(fname)['video']['duration']
+    if duration is None:
+        print(f'unknown duration of {fname}, convert without splitting')
+        convert_one_h265(fname, output_fname, preset=preset, encoder=encoder)
+        return
+    duration = float(duration)
+    segment_time = math.ceil(duration / segments)
+
+    # Segments are as large as the video file, keep them on the same file
+    # system as output instead of the temp directory.
+    tmp_dir = tempfile.mkdtemp(prefix='.segment-', dir=path.dirname(output_fname) or '.')
+    try:
+        ffmpeg.run_ffmpeg([
+            '-y', '-i', fname,
+            '-map', '0:v:0', '-map', '0:a?', '-c', 'copy',
+            '-f', 'segment', '-segment_time', str(segment_time), '-reset_timestamps', '1',
+            path.join(tmp_dir, f'part%03d{ext}')])
+        parts = sorted(e.path for e in os.scandir(tmp_dir) if e.name.startswith('part'))
+        converted = [path.join(tmp_dir, f'converted-{_bname(p)}{_OUT_SUFFIX}')
+                     for p in parts]
+
+        # Encoders run in their own processes, threads are enough.
+        with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+            futures = [executor.submit(_convert_segment, p, c, preset, encoder)
+                       for p, c in zip(parts, converted)]
+            for fut in futures:
+                fut.result()
+
+        concat_list = path.join(tmp_dir, 'concat.txt')
+        with open(concat_list, 'w') as f:
+            for c in converted:
+                # concat demuxer resolves relative path against list file.
+                f.write(f"file '{path.basename(c)}'\n")
+        argv = ['-y', '-f', 'concat', '-safe', '0', '-i', concat_list, '-c', 'copy']
+        # avconvert preset may produce H.264 output.
+        if ffmpeg.probe(converted[0], cache=False)['video']['codec_name'] == 'hevc':
+            # For QuickTime Player to know it's able to play this file.
+            argv += ['-tag:v', 'hvc1']
+        ffmpeg.run_ffmpeg(argv + [output_fname])
+    finally:
+        shutil.rmtree(tmp_dir)
 
 
 @argh.arg('-f', '--fpath', action='extend', nargs='+', required=True)
+@argh.arg('--hwaccel', choices=['none', 'auto'] + list(HWACCEL_ENCODERS))
 def convert_h265(fpath: List[str] = None,
                  pattern: str = None,
                  output_dir: str = DEFAULT_OUTPUT_DIR,
-                 preset: str = DEFAULT_AVCONVERT_PRESET) -> List[str]:
+                 preset: str = DEFAULT_AVCONVERT_PRESET,
+                 jobs: int = 2,
+                 hwaccel: str = 'none',
+                 log: bool = False,
+                 segments: int = 1) -> List[str]:
     """Converts video files to h.265 encoding, skip already converted files.
 
     Args:
@@ -43,48 +156,130 @@ def convert_h265(fpath: List[str] = None,
         pattern: glob with this pattern for directories in fpath
         output_dir: generate output in this directory
         preset: preset for `avconvert`
+        jobs: number of files to convert concurrently
+        hwaccel: convert with ffmpeg using this hardware HEVC encoder instead
+            of avconvert. auto picks the first one supported by ffmpeg, falls
+            back to avconvert if none is supported
+        log: write converter output of each file to <output file>.log instead
+            of terminal, so output of concurrent jobs is not interleaved
+        segments: split each video file into this many segments and convert
+            them in parallel, useful for converting a few large files
 
     Returns:
         result: list of output file name
     """
-    if not path.exists(output_dir):
-        os.makedirs(output_dir)
-
     fpath = geotag.glob_extend(fpath, pattern)
+    return _convert_h265_expanded(fpath, output_dir, preset, jobs, hwaccel, log, segments)
+
+
+def _convert_h265_expanded(fpath: List[str], output_dir: str, preset: str,
+                           jobs: int, hwaccel: str, log: bool, segments: int,
+                           on_ready: Optional[Callable[[str], None]] = None) -> List[str]:
+    """convert_h265 for fpath with directories already expanded.
+
+    on_ready is called with each output file name once the file is ready.
+    """
+    # Files with the same basename would be converted to the same output
+    # file, fail before converting any of them.
+    _build_bname_index(fpath)
+    os.makedirs(output_dir, exist_ok=True)
+
+    existing = _existing_outputs(output_dir)
     output_fpath = []
+    skipped = []
+    tasks = []
     for f in fpath:
-        bname, ext = path.splitext(f)
+        bname, ext = path.splitext(path.basename(f))
         if ext == '':
             raise ValueError(f'{f} has no suffix, is it really a video file?')
 
-        output_fname = path.join(output_dir, f'{bname}.{OUTPUT_EXT}')
-        if path.exists(output_fname):
+        output_bname = bname + _OUT_SUFFIX
+        output_fname = path.join(output_dir, output_bname)
+        if output_bname in existing:
             print(f'skip convert {f}')
             # Add to output file list so following action can process the
             # skip converting file.
             output_fpath.append(output_fname)
+            skipped.append(output_fname)
             continue
 
-        print(f'convert {f} to {output_fname}')
-        convert_one_h265(f, output_fname, preset=preset)
+        tasks.append((f, output_fname))
         output_fpath.append(output_fname)
 
+    if on_ready is None:
+        on_ready = lambda output_fname: None
+
+    if len(tasks) == 0:
+        for output_fname in skipped:
+            on_ready(output_fname)
+        return output_fpath
+
+    encoder = _hevc_encoder(hwaccel)
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+        futures = {executor.submit(_convert_task, f, output_fname, preset, encoder, log,
+                                   segments): (f, output_fname)
+                   for f, output_fname in tasks}
+        # Worker processes are forked on submit. Start processing skipped
+        # files only after that, a process forked while another thread holds
+        # a lock (e.g. stdout's) would deadlock on that lock.
+        for output_fname in skipped:
+            on_ready(output_fname)
+        for fut in as_completed(futures):
+            fut.result()
+            f, output_fname = futures[fut]
+            print(f'converted {f}')
+            on_ready(output_fname)
+
     return output_fpath
 
 
+def _existing_outputs(output_dir: str) -> Set[str]:
+    """Return names of output files in output_dir.
+
+    Read the directory once instead of checking each output file.
+    """
+    try:
+        with os.scandir(output_dir) as it:
+            return {e.name for e in it
+                    if e.name.endswith(_OUT_SUFFIX) and not e.name.startswith('.')
+                    and e.is_file()}
+    except FileNotFoundError:
+        return set()
+
+
+def _convert_task(fname: str, output_fname: str, preset: str, encoder: Optional[str],
+                  log: bool, segments: int):
+    print(f'convert {fname} to {output_fname}')
+    if not log:
+        convert_one_h265(fname, output_fname, preset=preset, encoder=encoder,
+                         segments=segments)
+        return
+
+    # Converter process writes to the log file directly through file
+    # descriptor. Line buffering keeps our own messages in order with it.
+    with open(f'{output_fname}.log', 'w', buffering=1) as f, \
+            redirect_stdout(f), redirect_stderr(f):
+        convert_one_h265(fname, output_fname, preset=preset, encoder=encoder,
+                         segments=segments)
+
+
 def _bname(fname: str):
     return path.splitext(path.basename(fname))[0]
 
 
-def _copy_time(fpath: List[str], output_fpath: List[str]):
-    bname2src = {}
-    for src in fpath:
-        bn = _bname(src)
-        existing_src = bname2src.get(bn)
-        if existing_src:
-            raise ValueError(f'duplicate file basename {existing_src} and {src}')
-        bname2src[bn] = src
+def _build_bname_index(fpath: List[str]) -> Dict[str, str]:
+    """Map file basename without suffix to file name."""
+    bnames = [_bname(src) for src in fpath]
+    dups = [bn for bn, cnt in Counter(bnames).items() if cnt > 1]
+    if dups:
+        # Report all duplicates at once.
+        dup_src = [src for bn, src in zip(bnames, fpath) if bn in dups]
+        raise ValueError(f'duplicate file basename: {", ".join(dup_src)}')
+    return dict(zip(bnames, fpath))
 
+
+def _copy_time(bname2src: Dict[str, str], output_fpath: List[str]):
+    pairs = []
     for dst in output_fpath:
         bn = _bname(dst)
         src = bname2src.get(bn)
@@ -92,7 +287,11 @@ def _copy_time(fpath: List[str], output_fpath: List[str]):
             print(f'WARNING no src file found for {dst}')
             continue
         print(f'copy time from {src} to {dst}')
-        geotag.copy_time(src, dst)
+        pairs.append((src, dst))
+    if len(pairs) == 0:
+        return
+
+    geotag.copy_time_pairs(pairs)
 
 
 @argh.arg('-f', '--fpath', action='extend', nargs='+', required=True,
@@ -110,38 +309,88 @@ def _copy_time(fpath: List[str], output_fpath: List[str]):
                ' Refer to geotag.video for more details')
 @argh.arg('--preset',
           help='preset for ``avconvert`` command')
+@argh.arg('-j', '--jobs',
+          help='number of files to convert concurrently')
+@argh.arg('--hwaccel', choices=['none', 'auto'] + list(HWACCEL_ENCODERS),
+          help='convert with ffmpeg hardware HEVC encoder instead of ``avconvert``')
+@argh.arg('--log',
+          help='write converter output of each file to <output file>.log')
+@argh.arg('--segments',
+          help='split each video file into this many segments and convert them in parallel')
 def flow(fpath: List[str] = None,
          gpslog: List[str] = None,
          pattern: str = None,
          output_dir: str = '000hevc',
          action: List[str] = None,
          timezone: str = 'auto',
-         preset: str = DEFAULT_AVCONVERT_PRESET):
+         preset: str = DEFAULT_AVCONVERT_PRESET,
+         jobs: int = 2,
+         hwaccel: str = 'none',
+         log: bool = False,
+         segments: int = 1):
     """Run work flow for video files."""
     if action is None:
         action = ['convert', 'copy-time', 'geotag']
 
     fpath = geotag.glob_extend(fpath, pattern)
+    # Output files are matched to source files by basename, build the index
+    # once for all actions.
+    bname2src = _build_bname_index(fpath)
 
-    if 'convert' in action:
-        output_fpath = convert_h265(fpath, pattern, output_dir, preset=preset)
-    else:
-        output_fpath = glob.glob(path.join(output_dir, f'*.{OUTPUT_EXT}'))
-        output_fpath.sort()
+    do_geotag = 'geotag' in action
+    if do_geotag and gpslog is None:
+        print('no gpslog, skip geotagg action')
+        do_geotag = False
 
-    if len(output_fpath) == 0:
-        print(f'no output files, exit')
+    def post_process(output_fpath: List[str]):
+        if 'copy-time' in action:
+            _copy_time(bname2src, output_fpath)
+        if do_geotag:
+            geotag.video_parallel(output_fpath, gpslog, timezone)
+
+    if 'convert' not in action:
+        output_fpath = sorted(path.join(output_dir, n) for n in _existing_outputs(output_dir))
+        if len(output_fpath) == 0:
+            print(f'no output files, exit')
+            return
+        post_process(output_fpath)
         return
 
-    if 'copy-time' in action:
-        _copy_time(fpath, output_fpath)
+    if 'copy-time' not in action and not do_geotag:
+        _convert_h265_expanded(fpath, output_dir, preset, jobs, hwaccel, log, segments)
+        return
 
-    if 'geotag' in action:
-        if gpslog is None:
-            print('no gpslog, skip geotagg action')
-            return
+    # Copy time and geotag converted files while converting others.
+    ready = queue.Queue()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        post = executor.submit(_post_process_ready, ready, post_process)
+        try:
+            _convert_h265_expanded(fpath, output_dir, preset, jobs, hwaccel, log, segments,
+                                   on_ready=ready.put)
+        finally:
+            ready.put(None)
+        post.result()
+
+
+def _post_process_ready(ready: queue.Queue, post_process: Callable[[List[str]], None]):
+    """Run post_process on files from ready queue until getting None.
 
-        geotag.video(output_fpath, gpslog=gpslog, timezone=timezone)
+    Files which become ready while processing previous files are processed
+    in one batch.
+    """
+    while True:
+        batch = [ready.get()]
+        while True:
+            try:
+                batch.append(ready.get_nowait())
+            except queue.Empty:
+                break
+        done = None in batch
+        batch = [f for f in batch if f is not None]
+        if batch:
+            post_process(batch)
+        if done:
+            return
 
 
 if __name__ == "__main__":